@@ -3,8 +3,12 @@
 """Console script for grumpy_tools."""
 import os
 import sys
-from StringIO import StringIO
-from pkg_resources import resource_filename, Requirement, DistributionNotFound
+try:
+    from cStringIO import StringIO  # Python 2
+except ImportError:
+    from io import StringIO
+
+from .compiler.util import NamedStream
 import logging
 logger = logging.getLogger(__package__)
 
@@ -17,8 +21,6 @@ ColorFormatter.colors['info'] = {'fg': 'green'}
 click_log.basic_config(logger)
 logger.propagate = True
 
-from . import grumpc, grumprun, pydeps
-
 
 @click.group('grumpy', cls=DefaultGroup, default='run', default_if_no_args=True)
 @click_log.simple_verbosity_option(logger, default='WARNING')
@@ -45,6 +47,8 @@ def transpile(script=None, modname=None, pep3147=False):
     """
     Translates the python SCRIPT file to Go, then prints to stdout
     """
+    from . import grumpc  # Deferred: pulls in the whole compiler package
+
     _ensure_gopath(raises=False)
 
     output = grumpc.main(stream=script, modname=modname, pep3147=pep3147)['gocode']
@@ -61,14 +65,17 @@ def transpile(script=None, modname=None, pep3147=False):
 @click.option('--keep-main', is_flag=True,
               help='Do not clear the temporary folder containing the transpilation result of main script')
 def run(file=None, cmd=None, modname=None, keep_main=False, pep3147=True, go_action='run'):
+    from . import grumprun  # Deferred: pulls in the whole compiler package
+
     _ensure_gopath()
 
     if modname:
         stream = None
     elif file:
-        stream = StringIO(file.read())
+        # Do not slurp the file into memory. grumprun seeks/reads it itself.
+        stream = NamedStream(file, '__main__.py')
     elif cmd:
-        stream = StringIO(cmd)
+        stream = NamedStream(StringIO(cmd), '__main__.py')
     else:   # Read from STDIN
         stdin = click.get_text_stream('stdin')
         if stdin.isatty():  # Interactive terminal -> REPL
@@ -77,11 +84,10 @@ def run(file=None, cmd=None, modname=None, keep_main=False, pep3147=True, go_act
                        err=True)
             sys.exit(1)
         else:               # Piped terminal
-            stream = StringIO(stdin.read())
+            stream = NamedStream(StringIO(stdin.read()), '__main__.py')
 
     if stream is not None:
         stream.seek(0)
-        stream.name = '__main__.py'
 
     result = grumprun.main(stream=stream, modname=modname, pep3147=pep3147,
                            clean_tempfolder=(not keep_main), go_action=go_action)
@@ -95,6 +101,8 @@ def depends(script=None, modname=None):
     """
     Discover with modules are needed to run the 'script' provided
     """
+    from . import pydeps  # Deferred: pulls in the whole compiler package
+
     _ensure_gopath()
 
     package_dir = os.path.dirname(os.path.abspath(script))
@@ -104,27 +112,36 @@ def depends(script=None, modname=None):
     sys.exit(0)
 
 
+_RUNTIME_GOPATH_CACHE = []  # Memoized result of the `pkg_resources` scan
+
+
 def _ensure_gopath(raises=True):
     environ_gopath = os.environ.get('GOPATH', '')
 
-    try:
-        runtime_gopath = resource_filename(
-            Requirement.parse('grumpy-runtime'),
-            'grumpy_runtime/data/gopath',
-        )
-    except DistributionNotFound:
-        runtime_gopath = None
-
-    if runtime_gopath and runtime_gopath not in environ_gopath:
-        gopaths = environ_gopath.split(':') + [runtime_gopath]
-        new_gopath = os.pathsep.join([p for p in gopaths if p])  # Filter empty ones
-        if new_gopath:
-            os.environ['GOPATH'] = new_gopath
+    if not _RUNTIME_GOPATH_CACHE:
+        # Deferred import: a bare `import pkg_resources` scans the whole
+        # sys.path, what would slow down `--help` and argument errors.
+        from pkg_resources import resource_filename, Requirement, DistributionNotFound
+        try:
+            runtime_gopath = resource_filename(
+                Requirement.parse('grumpy-runtime'),
+                'grumpy_runtime/data/gopath',
+            )
+        except DistributionNotFound:
+            runtime_gopath = None
+        _RUNTIME_GOPATH_CACHE.append(runtime_gopath)
+    runtime_gopath = _RUNTIME_GOPATH_CACHE[0]
+
+    gopaths = [p for p in environ_gopath.split(os.pathsep) if p]  # Filter empty ones
+    if runtime_gopath and runtime_gopath not in set(gopaths):
+        gopaths.append(runtime_gopath)
+        os.environ['GOPATH'] = os.pathsep.join(gopaths)
 
     if raises and not runtime_gopath and not environ_gopath:
         raise click.ClickException("Could not found the Grumpy Runtime 'data/gopath' resource.\n"
                                    "Is 'grumpy-runtime' package installed?")
-    logger.info("GOPATH: %s", os.environ.get("GOPATH"))
+    if logger.isEnabledFor(logging.INFO):  # Skip the environ read when filtered
+        logger.info("GOPATH: %s", os.environ.get("GOPATH"))
 
 
 if __name__ == "__main__":
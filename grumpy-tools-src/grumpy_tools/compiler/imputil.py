@@ -66,6 +66,10 @@ _CPYTHON_STDLIB_PATHS = (
 _NATIVE_MODULE_PREFIX = '__go__/'
 
 
+# Module level so that pickle can find it by name when dumping Import objects
+Binding = collections.namedtuple('Binding', ('bind_type', 'alias', 'value'))
+
+
 class Import(object):
   """Represents a single module import and all its associated bindings.
 
@@ -74,7 +78,7 @@ class Import(object):
   an Import object for module foo and another one for module bar.
   """
 
-  Binding = collections.namedtuple('Binding', ('bind_type', 'alias', 'value'))
+  Binding = Binding
 
   MODULE = "<BindType 'module'>"
   MEMBER = "<BindType 'member'>"
@@ -246,12 +250,33 @@ class _ImportCollector(algorithm.Visitor):
     self.imports.extend(self.importer.visit(node))
 
 
-def collect_imports(modname, script, gopath, package_dir=''):
+_PARSED_CACHE = {}  # script path -> (py_contents, mod, future_node, future_features)
+
+
+def parse_script(script, py_contents=None):
+  """Parses `script` to an AST, memoized per script path on its contents.
+
+  The same file gets parsed by the deps pass and by the transpile pass (and
+  again for every parent re-entry), so keep the parsed module around for as
+  long as the contents match.
+  """
   parser.patch_pythonparser()
-  with open(script) as py_file:
-    py_contents = py_file.read()
+  if py_contents is None:
+    with open(script) as py_file:
+      py_contents = py_file.read()
+
+  cached = _PARSED_CACHE.get(script)
+  if cached is not None and cached[0] == py_contents:
+    return cached[1:]
+
   mod = pythonparser.parse(py_contents)
   future_node, future_features = parse_future_features(mod)
+  _PARSED_CACHE[script] = (py_contents, mod, future_node, future_features)
+  return mod, future_node, future_features
+
+
+def collect_imports(modname, script, gopath, package_dir=''):
+  mod, future_node, future_features = parse_script(script)
   importer = Importer(gopath, modname, script,
                       future_features.absolute_import, package_dir=package_dir)
   collector = _ImportCollector(importer, future_node)
@@ -288,7 +313,24 @@ def calculate_transitive_deps(modname, script, gopath):
   return deps
 
 
-@lru_cache()
+@lru_cache(maxsize=4096)
+def _dir_entries(dirname):
+  """Cached directory listing, the same trick importlib's FileFinder uses:
+  one listdir answers every candidate-suffix probe for that directory."""
+  try:
+    return frozenset(os.listdir(dirname))
+  except OSError:
+    return frozenset()
+
+
+def _isfile_cached(path):
+  head, tail = os.path.split(path)
+  # Membership rejects the common misses without a syscall; only actual
+  # candidates pay the isfile stat (which also filters out directories).
+  return tail in _dir_entries(head) and os.path.isfile(path)
+
+
+@lru_cache(maxsize=4096)
 def find_script(dirname, name, main=False, use_grumpy_stdlib=True):
   if use_grumpy_stdlib and _GRUMPY_STDLIB_PATH and dirname in _CPYTHON_STDLIB_PATHS:
     # Grumpy stdlib have preference over CPython stdlib
@@ -299,14 +341,14 @@ def find_script(dirname, name, main=False, use_grumpy_stdlib=True):
 
   prefix = os.path.join(dirname, name.replace('.', os.sep))
   script = prefix + '.py'
-  if os.path.isfile(script):
+  if _isfile_cached(script):
     return script
   if main:
     script = os.path.join(prefix, '__main__.py')
-    if os.path.isfile(script):
+    if _isfile_cached(script):
       return script
   script = os.path.join(prefix, '__init__.py')
-  if os.path.isfile(script):
+  if _isfile_cached(script):
     return script
   return None
 
@@ -21,7 +21,10 @@ from __future__ import unicode_literals
 import codecs
 import contextlib
 import string
-import StringIO
+try:
+  from cStringIO import StringIO  # Python 2
+except ImportError:
+  from io import StringIO
 import textwrap
 
 try:
@@ -65,7 +68,7 @@ class Writer(object):
   """Utility class for writing blocks of Go code to a file-like object."""
 
   def __init__(self, out=None):
-    self.out = codecs.getwriter('utf8')(out or StringIO.StringIO())
+    self.out = codecs.getwriter('utf8')(out or StringIO())
     self.indent_level = 0
 
   def getvalue(self):
@@ -137,9 +140,41 @@ class Writer(object):
     self.indent_level -= n
 
 
+class NamedStream(object):
+  """Delegates to an open stream, but with a writable `name` attribute.
+
+  cStringIO objects (and real file objects) do not accept attribute
+  assignment, so the script name a stream stands for is carried here.
+  """
+
+  def __init__(self, stream, name):
+    self._stream = stream
+    self.name = name
+
+  def __getattr__(self, attr):
+    return getattr(self._stream, attr)
+
+
+class ListBuffer(object):
+  """Write-only file-like that collects chunks in a list.
+
+  Cheaper than StringIO for append-then-join usage: getvalue() makes the
+  only copy.
+  """
+
+  def __init__(self):
+    self.parts = []
+
+  def write(self, data):
+    self.parts.append(data)
+
+  def getvalue(self):
+    return b''.join(self.parts)
+
+
 def go_str(value):
   """Returns value as a valid Go string literal."""
-  io = StringIO.StringIO()
+  io = StringIO()
   io.write('"')
   for c in value:
     if c in _ESCAPES:
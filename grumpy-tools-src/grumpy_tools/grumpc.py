@@ -20,13 +20,25 @@
 from __future__ import unicode_literals
 
 import argparse
+import multiprocessing
 import os
 import sys
-from StringIO import StringIO
+try:
+  from cStringIO import StringIO  # Python 2
+except ImportError:
+  from io import StringIO
 import textwrap
-import pickle
+try:
+  import cPickle as pickle  # Python 2
+except ImportError:
+  import pickle
 import logging
 
+try:
+  from functools import lru_cache
+except ImportError:
+  from backports.functools_lru_cache import lru_cache
+
 import dill
 
 from .compiler import block
@@ -35,22 +47,59 @@ from .compiler import stmt
 from .compiler import util
 from .compiler.parser import patch_pythonparser
 import pythonparser
-from .pep_support.pep3147pycache import make_transpiled_module_folders, should_refresh, set_checksum, fixed_keyword
+from .pep_support.pep3147pycache import (get_checksum, get_gopath_folder,
+    get_transpiled_module_folder, make_transpiled_module_folders,
+    should_refresh, set_checksum, fixed_keyword)
 from . import pydeps
 
 logger = logging.getLogger(__name__)
 
+# Patch once on import (itself deferred to subcommand dispatch), instead of
+# paying the guarded call on every recursive _parse_and_visit invocation.
+patch_pythonparser()
+
+_abspath = lru_cache()(os.path.abspath)
+
+_GOPATH_FOLDERS_ADDED = set()  # pep3147 gopath folders already on $GOPATH
+
+
+def _ensure_gopath_folder(folder):
+  if folder in _GOPATH_FOLDERS_ADDED:
+    return
+  # Re-read the environ: recursive main() calls append their own folders
+  environ_gopath = os.environ.get('GOPATH', '')
+  if folder not in environ_gopath.split(os.pathsep):
+    os.environ['GOPATH'] = environ_gopath + os.pathsep + folder
+  _GOPATH_FOLDERS_ADDED.add(folder)
 
-def _parse_and_visit(stream, script, modname):
-  patch_pythonparser()
+
+def _parse_and_visit(stream, script, modname, ast_file=None, from_cache=False):
   gopath = os.environ['GOPATH']
 
   stream.seek(0)
   py_contents = stream.read()
-  mod = pythonparser.parse(py_contents)
 
-  # Do a pass for compiler directives from `from __future__ import *` statements
-  future_node, future_features = imputil.parse_future_features(mod)
+  mod = future_node = future_features = None
+  if from_cache and ast_file:
+    try:
+      with open(ast_file, 'rb') as ast_dumpfile:
+        mod, future_node, future_features = dill.load(ast_dumpfile)
+    except Exception as err:
+      # Race conditions with other scripts running or stale/broken dump
+      logger.info("Could not load parsed AST of '%s' from cache.", modname)
+      mod = None
+
+  if mod is None:
+    # Parses and does a pass for compiler directives from
+    # `from __future__ import *` statements. Shared with the deps pass.
+    mod, future_node, future_features = imputil.parse_script(script, py_contents)
+
+    if ast_file:
+      try:
+        with open(ast_file, 'wb') as ast_dumpfile:
+          dill.dump((mod, future_node, future_features), ast_dumpfile)
+      except Exception as err:
+        logger.warning("Could not store parsed AST of '%s' on cache: %s", modname, err)
 
   importer = imputil.Importer(gopath, modname, script,
                               future_features.absolute_import)
@@ -68,7 +117,7 @@ def _parse_and_visit(stream, script, modname):
 def _collect_deps(script, modname, pep3147_folders, from_cache=False, update_cache=True):
   if from_cache:
     try:
-      with open(pep3147_folders['dependencies_file']) as deps_dumpfile:
+      with open(pep3147_folders['dependencies_file'], 'rb') as deps_dumpfile:
         deps, import_objects = pickle.load(deps_dumpfile)
       return deps, import_objects
     except Exception as err:
@@ -92,7 +141,7 @@ def _collect_deps(script, modname, pep3147_folders, from_cache=False, update_cac
   if update_cache:
     try:
       with open(pep3147_folders['dependencies_file'], 'wb') as deps_dumpfile:
-        pickle.dump((deps, import_objects), deps_dumpfile)
+        pickle.dump((deps, import_objects), deps_dumpfile, pickle.HIGHEST_PROTOCOL)
     except Exception as err:
       logger.warning("Could not store dependencies of '%s' on cache: %s", modname, err)
     else:
@@ -115,103 +164,289 @@ def _recursively_transpile(import_objects, ignore=None):
         ignore.add(imp_obj.name)
         continue  # Let the ImportError raise on run time
 
-      # Recursively compile the discovered imports
-      result = main(stream=open(imp_obj.script), modname=name, pep3147=True,
+      # Recursively compile the discovered imports. Read the script once;
+      # the '.__init__' case would otherwise re-open and re-read it.
+      with open(imp_obj.script) as script_file:
+        stream = util.NamedStream(StringIO(script_file.read()), imp_obj.script)
+
+      result = main(stream=stream, modname=name, pep3147=True,
                     recursive=True, return_gocode=False, return_deps=True,
                     ignore=ignore)
       if name.endswith('.__init__'):
-        name = name.rpartition('.__init__')[0]
-        result = main(stream=open(imp_obj.script), modname=name, pep3147=True,
-                      recursive=True, return_gocode=False, return_deps=True,
-                      ignore=ignore)
-      yield result['deps']
-
-
-def _transpile(script, modname, imports, visitor, mod_block):
-  file_buffer = StringIO()
+        package_name = name.rpartition('.__init__')[0]
+        if package_name not in ignore:  # Already transpiled on this run?
+          stream.seek(0)
+          result = main(stream=stream, modname=package_name, pep3147=True,
+                        recursive=True, return_gocode=False, return_deps=True,
+                        ignore=ignore)
+      yield result
+
+
+# Dedented once at import time; _transpile runs once per module compiled.
+_MODULE_PREAMBLE_TMPL = textwrap.dedent("""\
+    package $package
+    import (
+    \tπg "grumpy"
+    $imports
+    )
+    var Code *πg.Code
+    func init() {
+    \tCode = πg.NewCode("<module>", $script, nil, 0, func(πF *πg.Frame, _ []*πg.Object) (*πg.Object, *πg.BaseException) {
+    \t\tvar πR *πg.Object; _ = πR
+    \t\tvar πE *πg.BaseException; _ = πE""")
+
+_MODULE_EPILOGUE_TMPL = textwrap.dedent("""\
+  \t\treturn nil, πE
+  \t})
+  \tπg.RegisterModule($modname, Code)
+  }""")
+
+
+# Pools smaller than this are not worth the fork + pickle overhead
+_PARALLEL_MIN_IMPORTS = 4
+
+_in_worker = False
+
+
+def _transpile_import(imp_obj):
+  """Pool worker: recursively transpiles one import in a child process."""
+  global _in_worker
+  _in_worker = True
+  deps = set()
+  sources = set()
+  for result in _recursively_transpile([imp_obj]):
+    deps.update(result['deps'])
+    sources.update(result['sources'])
+  # The gopath folders this child appended to its own environ are needed by
+  # the parent process for the final `go build`.
+  return deps, os.environ.get('GOPATH', ''), sources
+
+
+def _transpile_imports(import_objects, ignore):
+  """Transpiles the imports, independent ones fanned out to worker processes.
+
+  Falls back to the serial generator for small import lists, single-core
+  boxes, and inside workers (no nested pools).
+  """
+  import_objects = list(import_objects)
+  pending = [imp_obj for imp_obj in import_objects
+             if not imp_obj.is_native and imp_obj.script
+             and imp_obj.name not in ignore]
+  workers = multiprocessing.cpu_count() - 1
+  if _in_worker or workers < 2 or len(pending) < _PARALLEL_MIN_IMPORTS:
+    results = list(_recursively_transpile(import_objects, ignore=ignore))
+    subtree_sources = set()
+    for result in results:
+      subtree_sources.update(result['sources'])
+    return [result['deps'] for result in results], subtree_sources
+
+  pool = multiprocessing.Pool(min(workers, len(pending)))
+  try:
+    results = pool.map(_transpile_import, pending)
+  finally:
+    pool.close()
+    pool.join()
+
+  transitive_deps = []
+  subtree_sources = set()
+  environ_gopath = os.environ.get('GOPATH', '')
+  known_folders = set(environ_gopath.split(os.pathsep))
+  added_folders = []
+  for deps, child_gopath, sources in results:
+    transitive_deps.append(frozenset(deps))
+    subtree_sources.update(sources)
+    for folder in child_gopath.split(os.pathsep):
+      if folder and folder not in known_folders:
+        known_folders.add(folder)
+        added_folders.append(folder)
+  if added_folders:
+    os.environ['GOPATH'] = os.pathsep.join([environ_gopath] + added_folders)
+    _GOPATH_FOLDERS_ADDED.update(added_folders)
+
+  ignore.update(imp_obj.name for imp_obj in pending)
+  return transitive_deps, subtree_sources
+
+
+def _load_fresh_subtree(subtree_file, modname):
+  """Loads the persisted subtree manifest if every source in it is unchanged.
+
+  The manifest records the whole transitive import tree of a module as
+  (modname, script, checksum, mtime) tuples plus each branch's deps. A
+  source whose mtime still matches cannot have changed; only touched
+  files get re-hashed. When everything checks out, the module.go
+  outputs on disk are up to date and the recursive walk can be skipped.
+  """
+  try:
+    with open(subtree_file, 'rb') as subtree_dumpfile:
+      transitive_deps, sources = pickle.load(subtree_dumpfile)
+  except Exception:
+    # Race conditions with other scripts running or stale/broken dump
+    logger.info("Could not load import subtree of '%s' from cache.", modname)
+    return None
+
+  try:
+    for source_modname, source_script, _, _ in sources:
+      if not os.path.isfile(os.path.join(
+          get_transpiled_module_folder(source_script, source_modname),
+          'module.go')):
+        # An unchanged source is only skippable while its output is still
+        # on disk; a pruned __pycache__ (manual clean, tmpreaper on the
+        # mkdtemp fallbacks) has to force the walk to regenerate it.
+        return None
+  except ValueError:  # A pre-mtime dump of 3-tuples
+    return None
+  if not _sources_unchanged(sources):
+    return None
+  return transitive_deps, sources
+
+
+def _sources_unchanged(sources, skip_modname=None):
+  """True while every recorded (modname, script, checksum, mtime) source
+  still matches the bytes it was recorded with.
+
+  mtime-equal sources are trusted without re-reading; only touched files
+  get re-hashed. grumprun also vets its binary cache with this, skipping
+  the main module whose content is the cache key itself.
+  """
+  try:
+    for source_modname, source_script, checksum, mtime in sources:
+      if source_modname == skip_modname:
+        continue
+      if mtime is not None and os.stat(source_script).st_mtime == mtime:
+        continue  # Untouched since recorded
+      with open(source_script, 'rb') as source_file:
+        if get_checksum(source_file.read()) != checksum:
+          return False
+  except (IOError, OSError, ValueError):  # Unreadable, or a pre-mtime dump
+    return False
+  return True
+
+
+def _store_subtree(subtree_file, modname, transitive_deps, sources):
+  try:
+    with open(subtree_file, 'wb') as subtree_dumpfile:
+      pickle.dump((transitive_deps, sources), subtree_dumpfile,
+                  pickle.HIGHEST_PROTOCOL)
+  except Exception as err:
+    logger.warning("Could not store import subtree of '%s' on cache: %s",
+                   modname, err)
+
+
+def _transpile(script, modname, imports, visitor, mod_block, out=None):
+  """Writes Go code to the `out` file if given, else returns it as a string."""
+  file_buffer = util.ListBuffer() if out is None else out
   writer = util.Writer(file_buffer)
-  tmpl = textwrap.dedent("""\
-      package $package
-      import (
-      \tπg "grumpy"
-      $imports
-      )
-      var Code *πg.Code
-      func init() {
-      \tCode = πg.NewCode("<module>", $script, nil, 0, func(πF *πg.Frame, _ []*πg.Object) (*πg.Object, *πg.BaseException) {
-      \t\tvar πR *πg.Object; _ = πR
-      \t\tvar πE *πg.BaseException; _ = πE""")
-  writer.write_tmpl(tmpl, package=fixed_keyword(modname.split('.')[-1]),
+  writer.write_tmpl(_MODULE_PREAMBLE_TMPL, package=fixed_keyword(modname.split('.')[-1]),
                     script=util.go_str(script), imports=imports)
   with writer.indent_block(2):
-    for s in sorted(mod_block.strings):
-      writer.write('ß{} := πg.InternStr({})'.format(s, util.go_str(s)))
+    writer.write('\n'.join('ß' + s + ' := πg.InternStr(' + util.go_str(s) + ')'
+                           for s in sorted(mod_block.strings)))
     writer.write_temp_decls(mod_block)
     writer.write_block(mod_block, visitor.writer.getvalue())
-  writer.write_tmpl(textwrap.dedent("""\
-    \t\treturn nil, πE
-    \t})
-    \tπg.RegisterModule($modname, Code)
-    }"""), modname=util.go_str(modname))
-  return file_buffer
+  writer.write_tmpl(_MODULE_EPILOGUE_TMPL, modname=util.go_str(modname))
+  if out is None:
+    return file_buffer.getvalue()
 
 
 def main(stream=None, modname=None, pep3147=False, recursive=False, return_gocode=True, ignore=None, return_deps=False):
   ignore = ignore or set()
   ignore.add(modname)
-  script = os.path.abspath(stream.name)
+  script = _abspath(stream.name)
   assert script and modname, 'Script "%s" or Modname "%s" is empty' % (script, modname)
 
-  gopath = os.getenv('GOPATH', None)
+  gopath = os.environ.get('GOPATH', None)
   if not gopath:
     raise RuntimeError('GOPATH not set')
 
   pep3147_folders = make_transpiled_module_folders(script, modname)
   will_refresh = should_refresh(stream, script, modname)
 
+  checksum = None
+  if not will_refresh:
+    try:  # Unchanged source: the stored digest spares re-hashing the stream
+      with open(pep3147_folders['checksum_file'], 'rb') as checksum_file:
+        checksum = checksum_file.read()
+    except (IOError, OSError):
+      pass
+  if checksum is None:
+    # Hashed once; the stored checksum and the subtree manifest reuse it.
+    checksum = get_checksum(stream)
+
   deps, import_objects = _collect_deps(script, modname, pep3147_folders, from_cache=(not will_refresh))
-  deps = set(deps)
-  imports = ''.join('\t// _ "' + _package_name(name) + '"\n' for name in deps)
+  # Sorted for reproducible output; unchanged files then keep their mtime-
+  # friendly byte-identical module.go across runs.
+  imports = ''.join('\t// _ "%s"\n' % _package_name(name) for name in sorted(deps))
 
   if will_refresh or return_gocode:
-    visitor, mod_block = _parse_and_visit(stream, script, modname)
-    file_buffer = _transpile(script, modname, imports, visitor, mod_block)
+    visitor, mod_block = _parse_and_visit(stream, script, modname,
+                                          ast_file=pep3147_folders['ast_file'],
+                                          from_cache=(not will_refresh))
   else:
-    file_buffer = None
+    visitor = mod_block = None
+
+  gocode = None
+  if visitor is not None and return_gocode:
+    gocode = _transpile(script, modname, imports, visitor, mod_block)
 
+  transitive_deps = []
+  subtree_sources = set()
   if recursive:
-    transitive_deps = _recursively_transpile(import_objects, ignore=ignore)
+    subtree = None
+    if not will_refresh:
+      subtree = _load_fresh_subtree(pep3147_folders['subtree_file'], modname)
+    if subtree is not None:
+      # Whole import tree is byte-identical to the last transpile: the
+      # submodules' module.go files are already on disk, so only their
+      # gopath folders and names need replaying.
+      transitive_deps, subtree_sources = subtree
+      for source_modname, source_script, _, _ in subtree_sources:
+        ignore.add(source_modname)
+        _ensure_gopath_folder(get_gopath_folder(source_script, source_modname))
+    else:
+      # Materialized right away: each entry transpiles a submodule to disk,
+      # what has to happen even when the caller does not want the deps back.
+      transitive_deps, subtree_sources = _transpile_imports(import_objects, ignore)
+      _store_subtree(pep3147_folders['subtree_file'], modname,
+                     transitive_deps, subtree_sources)
 
   if pep3147:
-    new_gopath = pep3147_folders['gopath_folder']
-    if new_gopath not in os.environ['GOPATH'].split(os.pathsep):
-      os.environ['GOPATH'] += os.pathsep + new_gopath
+    _ensure_gopath_folder(pep3147_folders['gopath_folder'])
 
-    if file_buffer:
-      file_buffer.seek(0)
+    if visitor is not None:
       mod_dir = pep3147_folders['transpiled_module_folder']
       with open(os.path.join(mod_dir, 'module.go'), 'w+') as transpiled_file:
-        transpiled_file.write(file_buffer.read())
-      set_checksum(stream, script, modname)
+        if gocode is not None:
+          transpiled_file.write(gocode)
+        else:
+          # No caller wants the string back: stream straight to the file
+          _transpile(script, modname, imports, visitor, mod_block,
+                     out=transpiled_file)
+      set_checksum(stream, script, modname, checksum=checksum)
 
   result = {}
   if return_gocode:
-    assert file_buffer, "Wrong logic paths. 'file_buffer' should be available here!"
-    file_buffer.seek(0)
-    result['gocode'] = file_buffer.read()
+    assert gocode, "Wrong logic paths. 'gocode' should be available here!"
+    result['gocode'] = gocode
   if return_deps:
-    result['deps'] = frozenset(deps.union(*transitive_deps))
+    deps.update(*transitive_deps)
+    result['deps'] = frozenset(deps)
+    try:
+      source_mtime = os.stat(script).st_mtime
+    except OSError:  # STDIN/-c scripts live in the temporary pycache only
+      source_mtime = None
+    result['sources'] = frozenset(subtree_sources.union(
+      [(modname, script, checksum, source_mtime)]))
   return result
 
 
+@lru_cache(maxsize=4096)
 def _package_name(modname):
   if modname.startswith('__go__/'):
     return '__python__/' + modname
   return '__python__/' + fixed_keyword(modname).replace('.', '/')
 
 
+@lru_cache(maxsize=4096)
 def _get_parent_packages(modname):
-  package_parts = modname.split('.')
-  parent_parts = package_parts[:-1]
-  for i, _ in enumerate(parent_parts):
-    yield '.'.join(parent_parts[:(-i or None)])
+  parts = modname.split('.')
+  return ['.'.join(parts[:i]) for i in range(1, len(parts))]
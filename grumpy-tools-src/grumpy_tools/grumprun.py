@@ -21,18 +21,27 @@ Usage: $ grumprun -m <module>             # Run the named module.
 """
 
 import argparse
+import mmap
 import os
+try:
+  import cPickle as pickle  # Python 2
+except ImportError:
+  import pickle
 import random
 import shutil
-import string
 import subprocess
 import sys
 import tempfile
 import logging
-from StringIO import StringIO
+try:
+  from cStringIO import StringIO  # Python 2
+except ImportError:
+  from io import StringIO
 
 from .compiler import imputil
-from .pep_support.pep3147pycache import make_transpiled_module_folders
+from .compiler import util
+from .pep_support.pep3147pycache import (GRUMPY_MAGIC_TAG, get_checksum,
+    make_transpiled_module_folders)
 from . import grumpc
 
 logger = logging.getLogger(__name__)
@@ -58,19 +67,73 @@ TRACEBACK_DEPENDENCIES = [
   'types',
 ]
 
-module_tmpl = string.Template("""\
+def _cache_folder(name):
+  """Returns (and makes) the per-user grumpy cache folder `name`."""
+  folder = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'grumpy', name)
+  if not os.path.isdir(folder):
+    os.makedirs(folder)
+  return folder
+
+
+def _bincache_path(checksum):
+  """Returns the cached-binary path for a source checksum.
+
+  The magic tag in the path ties every entry to the grumpy version that
+  built it, the same way __pycache__ tags .pyc files: upgrading grumpy
+  invalidates the whole cache instead of reusing binaries linked against
+  the old runtime forever. Nothing prunes these folders; entries are
+  content-addressed, so a stale one is dead disk space, never a wrong
+  answer.
+  """
+  return os.path.join(_cache_folder(os.path.join('bincache', GRUMPY_MAGIC_TAG)),
+                      checksum)
+
+
+def _bincache_fresh(cached_binary):
+  """True when the imports baked into a cached binary are still unchanged.
+
+  The cache key only covers the main script's bytes; the binary also
+  links in every transpiled import, vouched for by the sources manifest
+  written beside it at build time. No manifest means no trust: rebuild.
+  """
+  try:
+    with open(cached_binary + '.sources', 'rb') as sources_file:
+      sources = pickle.load(sources_file)
+  except Exception:
+    return False
+  # The main module is skipped: its checksum is the cache key itself, and
+  # -c/stdin scripts have no stable path left to re-hash.
+  return grumpc._sources_unchanged(sources, skip_modname='__main__')
+
+
+def _go_env():
+  """Environ for Go subprocesses, with the build cache kept between runs.
+
+  A fresh GOCACHE makes Go recompile grumpy, traceback and every
+  transitive __go__/... import from scratch on each invocation.
+  """
+  env = os.environ.copy()
+  env.setdefault('GOCACHE', _cache_folder('gocache'))
+  return env
+
+
+# Plain %-formatting: string.Template re-parses the template with a regex
+# on every substitute() call.
+module_tmpl = """\
 package main
 import (
 \t"os"
 \t"grumpy"
-\tmod "$package"
-$imports
+\tmod "%(package)s"
+%(imports)s
 )
 func main() {
 \tgrumpy.ImportModule(grumpy.NewRootFrame(), "traceback")
 \tos.Exit(grumpy.RunMain(mod.Code))
 }
-""")
+"""
 
 
 def main(stream=None, modname=None, pep3147=False, clean_tempfolder=True, go_action='run'):
@@ -80,6 +143,7 @@ def main(stream=None, modname=None, pep3147=False, clean_tempfolder=True, go_act
   gopath = os.environ['GOPATH']
 
   # CPython does not cache the __main__. Should I?
+  source_mmap = None
   try:
     script = None
     if modname and not stream:  # TODO: move all this `if modname` to the CLI handling?
@@ -99,28 +163,57 @@ def main(stream=None, modname=None, pep3147=False, clean_tempfolder=True, go_act
       if not script:
         raise RuntimeError("can't find module '%s'", modname)
 
-      stream = StringIO(open(script).read())
-      if script.endswith('__main__.py'):
-        stream.name = script
-      else:
-        stream.name = '__main__.py'
+      fd = os.open(script, os.O_RDONLY)
+      try:
+        # Zero-copy view of the on-disk script. cStringIO reads straight
+        # out of the mmapped pages instead of a heap copy of the source,
+        # so the mmap must outlive the stream (closed in the finally).
+        source_mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        source = StringIO(source_mmap)
+      except ValueError:  # Empty scripts cannot be mmapped
+        source = StringIO('')
+      finally:
+        os.close(fd)
+      stream = util.NamedStream(
+        source, script if script.endswith('__main__.py') else '__main__.py')
 
     script = os.path.abspath(stream.name)
     modname = '__main__'
 
+    stream.seek(0)
+    data = stream.read()
+    checksum = get_checksum(data)
+
+    cached_binary = None
+    if go_action == 'run':
+      cached_binary = _bincache_path(checksum)
+      if os.path.isfile(cached_binary) and _bincache_fresh(cached_binary):
+        # Byte-identical source with untouched imports was already built:
+        # skip the transpile and the whole Go toolchain, just run the
+        # binary.
+        logger.info('Running cached binary of checksum %s', checksum[:8])
+        try:
+          return subprocess.Popen([cached_binary]).wait()
+        except OSError:
+          # Corrupt or unrunnable entry (e.g. truncated by a build that
+          # predates the atomic rename): evict it and fall through to a
+          # fresh build instead of failing every run from here on.
+          logger.warning('Evicting unrunnable cached binary %s', cached_binary)
+          try:
+            os.remove(cached_binary)
+          except OSError:
+            pass
+
     pep3147_folders = make_transpiled_module_folders(script, modname)
     workdir = pep3147_folders['transpiled_base_folder']
 
     # Generate a dummy python script on the 'cache_folder'
     script_name = os.path.join(pep3147_folders['cache_folder'], os.path.basename(script))
     with open(script_name, 'wb') as script_file:
-      stream.seek(0)
-      script_file.write(stream.read())
+      script_file.write(data)
 
     py_dir = os.path.join(workdir, 'src', '__python__')
 
-    mod_dir = pep3147_folders['transpiled_module_folder']
-
     ## TODO: Manage the STDIN and `-c` scripts situation
     # script = os.path.join(py_dir, 'module.py')
     # with open(script, 'w') as f:
@@ -130,32 +223,70 @@ def main(stream=None, modname=None, pep3147=False, clean_tempfolder=True, go_act
     gopath_folder = pep3147_folders['gopath_folder']
     os.environ['GOPATH'] = os.pathsep.join([gopath_folder, gopath]) #, workdir])
 
-    # Compile the dummy script to Go using grumpc.
-    with open(os.path.join(mod_dir, 'module.go'), 'w+') as dummy_file:
-      result = grumpc.main(stream, modname=modname, pep3147=True, recursive=True, return_deps=True)
-      transpiled, deps = result['gocode'], result['deps']
-      dummy_file.write(transpiled)
+    # Compile the dummy script to Go using grumpc. It streams module.go
+    # into the pep3147 folder itself; asking for the gocode string back
+    # would only buffer the whole output and write the same file twice.
+    compiled = grumpc.main(stream, modname=modname, pep3147=True, recursive=True,
+                           return_gocode=False, return_deps=True)
+    deps = compiled['deps']
 
     # Make sure traceback is available in all Python binaries.
     names = sorted(set(['traceback'] + TRACEBACK_DEPENDENCIES).union(deps))
 
     go_main = os.path.join(workdir, 'main.go')
     package = grumpc._package_name(modname)
-    imports = ''.join('\t_ "' + grumpc._package_name(name) + '"\n' for name in names)
-    with open(go_main, 'w') as f:
-      f.write(module_tmpl.substitute(package=package, imports=imports))
-    logger.info('`go run` GOPATH=%s', os.environ['GOPATH'])
+    imports = ''.join(['\t_ "%s"\n' % grumpc._package_name(name) for name in names])
+    rendered = module_tmpl % {'package': package, 'imports': imports}
+    try:
+      with open(go_main, 'rb') as main_file:
+        existing = main_file.read()
+    except (IOError, OSError):
+      existing = None
+    if existing != rendered.encode('utf-8'):
+      # One write(2) on a raw fd instead of the buffered file-object chain.
+      # Left untouched when the import set is stable, so its mtime does not
+      # invalidate `go build`'s cache key for the top-level package.
+      main_fd = os.open(go_main, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+      try:
+        os.write(main_fd, rendered.encode('utf-8'))
+      finally:
+        os.close(main_fd)
+    if logger.isEnabledFor(logging.INFO):  # Skip the environ read when filtered
+      logger.info('`go run` GOPATH=%s', os.environ['GOPATH'])
     if go_action == 'run':
-      subprocess_cmd = 'go run ' + go_main
+      # Build into the content-addressed cache so the next run of the same
+      # source skips straight to executing the binary. The build lands on
+      # a private temp name and is renamed in atomically: an interrupted
+      # or concurrent build must never leave a truncated binary at the
+      # path the cache-hit check trusts.
+      build_tmp = '%s.%d.tmp' % (cached_binary, os.getpid())
+      result = subprocess.Popen(['go', 'build', '-o', build_tmp, go_main],
+                                env=_go_env()).wait()
+      if result:
+        try:
+          os.remove(build_tmp)
+        except OSError:
+          pass
+        return result
+      # Manifest first, then the binary: a binary at the cache path always
+      # has the sources manifest its next hit check needs.
+      sources_tmp = '%s.sources.%d.tmp' % (cached_binary, os.getpid())
+      with open(sources_tmp, 'wb') as sources_file:
+        pickle.dump(compiled['sources'], sources_file, pickle.HIGHEST_PROTOCOL)
+      os.rename(sources_tmp, cached_binary + '.sources')
+      os.rename(build_tmp, cached_binary)
+      return subprocess.Popen([cached_binary]).wait()
     elif go_action == 'build':
-      subprocess_cmd = 'go build ' + go_main
+      subprocess_cmd = ['go', 'build', go_main]
     elif go_action == 'debug':
-      subprocess_cmd = 'dlv debug --listen=:2345 --log ' + go_main
+      subprocess_cmd = ['dlv', 'debug', '--listen=:2345', '--log', go_main]
     else:
       raise NotImplementedError('Go action "%s" not implemented' % go_action)
     logger.debug('Starting subprocess: `%s`', subprocess_cmd)
-    return subprocess.Popen(subprocess_cmd, shell=True).wait()
+    return subprocess.Popen(subprocess_cmd, env=_go_env()).wait()
   finally:
+    if source_mmap is not None:
+      source_mmap.close()
     if 'pep3147_folders' in locals():
       if clean_tempfolder:
         shutil.rmtree(pep3147_folders['cache_folder'], ignore_errors=True)
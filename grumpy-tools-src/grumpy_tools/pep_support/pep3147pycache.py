@@ -1,16 +1,16 @@
 # coding: utf-8
 from __future__ import unicode_literals
 
+import atexit
+import collections
+import errno
 import os
-import sys
+import shutil
+import stat
 import logging
 import hashlib
 import tempfile
-import warnings
-from backports.functools_lru_cache import lru_cache
-from backports.tempfile import TemporaryDirectory
 
-import importlib2
 import grumpy_tools
 
 from ..compiler import imputil
@@ -20,7 +20,6 @@ logger = logging.getLogger(__name__)
 GOPATH_FOLDER = 'gopath'
 TRANSPILED_MODULES_FOLDER = 'src/__python__/'
 GRUMPY_MAGIC_TAG = 'grumpy-' + grumpy_tools.__version__.replace('.', '')  # alike cpython-27
-ORIGINAL_MAGIC_TAG = sys.implementation.cache_tag  # On Py27, only because importlib2
 
 # See: https://golang.org/ref/spec#Keywords
 _GO_RESERVED_KEYWORDS = {
@@ -31,51 +30,136 @@ _GO_RESERVED_KEYWORDS = {
   'continue',     'for',          'import',       'return',       'var',
 }.union(['main'])  # Found to be troublesome as module names
 
-_temporary_directories = []  # Will be cleaned up on main Python exit.
+if hasattr(hashlib, 'blake2b'):
+    # Change-detection digest, not a security one: BLAKE2b-160 is ~3x
+    # faster than SHA-1 at the same digest width.
+    _CHECKSUM_SUFFIX = 'b2'
 
+    def _source_hash():
+        return hashlib.blake2b(digest_size=20)
+else:  # Python 2 hashlib ships no BLAKE2
+    _CHECKSUM_SUFFIX = 'sha1'
+    _source_hash = hashlib.sha1
 
-class SilentTemporaryDirectory(TemporaryDirectory):
-    '''TemporaryDirectory that does not warn on implicit cleanup'''
-    @classmethod
-    def _cleanup(cls, name, warn_message):
-        logger.debug(warn_message)
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            result = TemporaryDirectory._cleanup(name, warn_message)
-        return result
+# Copying a pre-built zero-length state is cheaper than the constructor,
+# which matters when hashing thousands of few-hundred-byte modules.
+_HASH_PROTO = _source_hash()
+
+_DIGEST_LENGTH = len(_HASH_PROTO.hexdigest())  # 40 for both algorithms
+
+
+def _memoize(func):
+    """Plain dict memoizer for the path helpers below.
+
+    They are all keyed on a couple of strings, so the pure-Python
+    lru_cache backport would pay _make_key plus an RLock round trip on
+    every hit for eviction these small caches never need.
+    """
+    cache = {}
+
+    def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            result = cache[args] = func(*args)
+            return result
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+# realpath readlink()s every component; bound that to once per unique path.
+_realpath = _memoize(os.path.realpath)
+
+
+_DerivedPaths = collections.namedtuple('_DerivedPaths', (
+    'cache_folder', 'gopath_folder', 'transpiled_base_folder',
+    'checksum_file', 'dependencies_file', 'ast_file', 'subtree_file'))
+
+
+@_memoize
+def _derived_paths(script_path, module_name):
+    """All the per-module pycache paths, joined once per (script, module)."""
+    cache_folder = get_pycache_folder(script_path, module_name)
+    gopath_folder = os.path.join(cache_folder, GOPATH_FOLDER)
+    return _DerivedPaths(
+        cache_folder,
+        gopath_folder,
+        os.path.join(gopath_folder, TRANSPILED_MODULES_FOLDER),
+        os.path.join(cache_folder, 'checksum-%s.%s' % (module_name, _CHECKSUM_SUFFIX)),
+        os.path.join(cache_folder, 'dependencies-%s.pkl' % module_name),
+        os.path.join(cache_folder, 'ast-%s.pkl' % module_name),
+        os.path.join(cache_folder, 'subtree-%s.pkl' % module_name),
+    )
 
 
 def get_depends_path(script_path, module_name):
-    pycache_folder = get_pycache_folder(script_path, module_name)
-    return os.path.join(pycache_folder, 'dependencies-%s.pkl' % module_name)
+    return _derived_paths(script_path, module_name).dependencies_file
 
 
-def get_checksum_path(script_path, module_name):
-    pycache_folder = get_pycache_folder(script_path, module_name)
-    return os.path.join(pycache_folder, 'checksum-%s.sha1' % module_name)
+def get_ast_path(script_path, module_name):
+    return _derived_paths(script_path, module_name).ast_file
 
 
-def get_checksum(stream):
-    stream.seek(0)
-    return hashlib.sha1(stream.read()).hexdigest()
+def get_subtree_path(script_path, module_name):
+    return _derived_paths(script_path, module_name).subtree_file
 
 
-def set_checksum(stream, script_path, module_name):
-    with open(get_checksum_path(script_path, module_name), 'w') as chk_file:
-        chk_file.write(get_checksum(stream))
+def get_checksum_path(script_path, module_name):
+    return _derived_paths(script_path, module_name).checksum_file
 
 
-def should_refresh(stream, script_path, modname):
+def get_checksum(stream):
+    checksum = _HASH_PROTO.copy()
+    if isinstance(stream, bytes):  # Already-read source buffer
+        checksum.update(stream)
+        return checksum.hexdigest()
+    # Hash in 64 KiB blocks: memory stays flat and hashing overlaps the
+    # read syscalls instead of waiting on a whole-file slurp.
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(65536), b''):
+        checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def set_checksum(stream, script_path, module_name, checksum=None):
+    # The digest is ready before the destination is touched, and lands
+    # there through an atomic rename: a crash mid-write leaves the old
+    # checksum intact instead of a truncated file that forces a full
+    # retranspile on the next run.
+    checksum = checksum or get_checksum(stream)
+    checksum_path = get_checksum_path(script_path, module_name)
+    tmp_path = checksum_path + '.tmp'
+    with open(tmp_path, 'w') as chk_file:
+        chk_file.write(checksum)
+        chk_file.flush()
+        os.fsync(chk_file.fileno())
+    os.rename(tmp_path, checksum_path)
+
+
+def should_refresh(stream, script_path, modname, checksum=None):
     checksum_filename = get_checksum_path(script_path, modname)
-    if not os.path.exists(checksum_filename):
+    file_stat = _cached_stat(checksum_filename)
+    if file_stat is None or file_stat.st_size != _DIGEST_LENGTH:
+        # Missing or not a whole digest: no open needed to decide
         logger.debug("Should transpile '%s'", modname)
         return True
 
-    with open(checksum_filename, 'r+') as checksum_file:
-        existing_checksum = checksum_file.read()
+    if checksum is None:
+        script_stat = _cached_stat(script_path)
+        if script_stat is not None and script_stat.st_mtime < file_stat.st_mtime:
+            # Checksum written after the last source edit: the content
+            # cannot have changed, so skip hashing the stream entirely.
+            logger.debug("No need to refresh '%s' (mtime)", modname)
+            return False
+
+    try:
+        with open(checksum_filename, 'rb') as checksum_file:
+            existing_checksum = checksum_file.read(_DIGEST_LENGTH)
+    except (IOError, OSError):
+        logger.debug("Should transpile '%s'", modname)
+        return True
 
-    new_checksum = get_checksum(stream)
-    if new_checksum != existing_checksum:
+    if (checksum or get_checksum(stream)) != existing_checksum:
         logger.debug("Should refresh '%s' (%s)", modname, existing_checksum[:8])
         return True
 
@@ -83,7 +167,6 @@ def should_refresh(stream, script_path, modname):
     return False
 
 
-@lru_cache()
 def get_pycache_folder(script_path, module_name):
     """
     Gets the __pycache__ folder or PEP-3147
@@ -91,6 +174,14 @@ def get_pycache_folder(script_path, module_name):
     Returns cache_folder path. Can be temporary.
     If so, will be cleaned automatically unless it is for __main__ module.
     """
+    # Canonical cache key: the same script reached through a symlink or
+    # another path spelling must not mint a second folder (for __main__,
+    # a second leaked mkdtemp).
+    return _pycache_folder(_realpath(script_path), module_name)
+
+
+@_memoize
+def _pycache_folder(script_path, module_name):
     assert script_path.endswith('.py')
 
     if module_name == '__main__':
@@ -98,78 +189,113 @@ def get_pycache_folder(script_path, module_name):
         logger.info("__main__ pycache folder: %s", cache_folder)
         return cache_folder
 
-    ### TODO: Fix race conditions
-    sys.implementation.cache_tag = GRUMPY_MAGIC_TAG
-    cache_folder = os.path.abspath(os.path.normpath(
-        importlib2._bootstrap.cache_from_source(script_path)
-    ))
-    sys.implementation.cache_tag = ORIGINAL_MAGIC_TAG
-    ###
+    # PEP-3147 path computed inline: same result as importlib2's
+    # cache_from_source under GRUMPY_MAGIC_TAG, minus the thread-unsafe
+    # sys.implementation.cache_tag swap that call required.
+    head, tail = os.path.split(script_path)
+    cache_folder = os.path.abspath(os.path.normpath(os.path.join(
+        head, '__pycache__',
+        os.path.splitext(tail)[0] + '.' + GRUMPY_MAGIC_TAG + '.pyc')))
 
     first_existing = _get_first_existing_parent(cache_folder)
 
     if not os.access(first_existing, os.W_OK):
-        cache_folder = SilentTemporaryDirectory(suffix='__pycache__')
-        _temporary_directories.append(cache_folder)  # Hold GC until Python exits
-        logger.info("Natural __pycache__ folder not available. Using %s", cache_folder.name)
-        return cache_folder.name
+        cache_folder = tempfile.mkdtemp(suffix='__pycache__')
+        # Cleaned on main Python exit; no TemporaryDirectory object to keep
+        # alive nor its ResourceWarning machinery to silence on cleanup.
+        atexit.register(shutil.rmtree, cache_folder, ignore_errors=True)
+        logger.info("Natural __pycache__ folder not available. Using %s", cache_folder)
+        return cache_folder
 
     return cache_folder
 
 
-def _get_first_existing_parent(cache_folder):
-    path_parts = cache_folder.split(os.path.sep)
-    if path_parts[0] == '':  # From root.
-        path_parts[0] = os.path.sep
+@_memoize
+def _cached_stat(path):
+    """Memoized stat probe; cleared whenever this module creates folders.
 
-    for i, _ in enumerate(path_parts):
-        subpath = os.path.join(*path_parts[:(-i or None)])
-        if os.path.exists(subpath):
-            return subpath
+    Follows symlinks, like the os.path.exists checks it replaces.
+    """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _get_first_existing_parent(cache_folder):
+    # Walk up with dirname: no part list and no per-level join of the
+    # whole prefix like the old split/join loop paid.
+    path = cache_folder
+    while path:
+        if _cached_stat(path) is not None:
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:  # Reached the filesystem root
+            break
+        path = parent
 
 
 def get_gopath_folder(script_path, module_name):
-    cache_folder = get_pycache_folder(script_path, module_name)
-    return os.path.join(cache_folder, GOPATH_FOLDER)
+    return _derived_paths(script_path, module_name).gopath_folder
 
 
 def get_transpiled_base_folder(script_path, module_name):
-    gopath_folder = get_gopath_folder(script_path, module_name)
-    return os.path.join(gopath_folder, TRANSPILED_MODULES_FOLDER)
+    return _derived_paths(script_path, module_name).transpiled_base_folder
 
 
+@_memoize
 def get_transpiled_module_folder(script_path, module_name):
-    module_name = fixed_keyword(module_name)
+    # Single split: fixing keywords per part skips fixed_keyword's own
+    # split/join round trip. The unfixed name goes to the base-folder
+    # lookup so its memoized entries are shared with the other callers.
+    parts = [fixed_keyword(part, split='') for part in module_name.split('.')]
     transpiled_base_folder = get_transpiled_base_folder(script_path, module_name)
-    parts = module_name.split('.')
     return os.path.join(transpiled_base_folder, *parts)
 
 
+@_memoize
+def _parent_link_spec(parent_package, parent_script):
+    """Resolved script and transpiled folder of one parent package.
+
+    Every sibling module of a package walks the same chain of parents, so
+    the find_script probe and folder derivation are shared process-wide:
+    only the first module of a package pays for them.
+    """
+    parent_package_script = imputil.find_script(parent_package, parent_script)
+    if not parent_package_script:
+        return None
+    return (parent_package_script,
+            get_transpiled_module_folder(parent_package_script, parent_package))
+
+
 def link_parent_modules(script_path, module_name):
     package_parts = module_name.split('.')[:-1]
     if not package_parts:
         return  # No parent packages to be linked
 
-    script_parts = script_path.split(os.sep)
-    if script_parts[-1] == '__init__.py':
-        script_parts = script_parts[:-1]
-    if script_parts[0] == '':
-        script_parts[0] = '/'
-    script_parts = script_parts[:-1]
-
-    for i, part in enumerate(reversed(package_parts)):
-        parent_script = os.path.join(*script_parts[:(-i or None)])
-        parent_package = '.'.join(package_parts[:(-i or None)])
-        parent_package_script = imputil.find_script(parent_package, parent_script)
-        if not parent_package_script:
-            continue
-        parent_module_folder = get_transpiled_module_folder(parent_package_script, parent_package)
-        local_parent_module_folder = get_transpiled_module_folder(script_path, parent_package)
-
-        logger.debug("Checking link of package '%s' on %s",
-                     parent_package, local_parent_module_folder)
-        _maybe_link_paths(os.path.join(parent_module_folder, 'module.go'),
-                          os.path.join(local_parent_module_folder, 'module.go'))
+    # The deepest parent lives one folder up from the script — two up
+    # when the script is itself a package __init__. Plain dirname calls,
+    # no split/rejoin of the whole path.
+    parent_script = os.path.dirname(script_path)
+    if os.path.basename(script_path) == '__init__.py':
+        parent_script = os.path.dirname(parent_script)
+
+    # Deepest parent first, peeling one component per step: dirname and
+    # rpartition replace the O(d^2) `parts[:(-i or None)]` slice-and-join
+    # that the old loop redid on every iteration.
+    parent_package = '.'.join(package_parts)
+    for _ in package_parts:
+        link_spec = _parent_link_spec(parent_package, parent_script)
+        if link_spec:
+            parent_module_folder = link_spec[1]
+            local_parent_module_folder = get_transpiled_module_folder(script_path, parent_package)
+
+            logger.debug("Checking link of package '%s' on %s",
+                         parent_package, local_parent_module_folder)
+            _maybe_link_paths(os.path.join(parent_module_folder, 'module.go'),
+                              os.path.join(local_parent_module_folder, 'module.go'))
+        parent_script = os.path.dirname(parent_script)
+        parent_package = parent_package.rpartition('.')[0]
 
 
 def make_transpiled_module_folders(script_path, module_name):
@@ -178,43 +304,84 @@ def make_transpiled_module_folders(script_path, module_name):
 
     Recursively "stomp" the files found in places that a folder is needed.
     """
+    paths = _derived_paths(script_path, module_name)
     needed_folders = {
-        'cache_folder': get_pycache_folder(script_path, module_name),
-        'gopath_folder': get_gopath_folder(script_path, module_name),
-        'transpiled_base_folder': get_transpiled_base_folder(script_path, module_name),
+        'cache_folder': paths.cache_folder,
+        'gopath_folder': paths.gopath_folder,
+        'transpiled_base_folder': paths.transpiled_base_folder,
         'transpiled_module_folder': get_transpiled_module_folder(script_path, module_name),
     }
-    for role, folder in needed_folders.items():
-        if os.path.isfile(folder):  # 1. Need a folder. Remove the file
-            os.unlink(folder)
-        if not os.path.exists(folder):  # 2. Create the needed folder
-            os.makedirs(folder)
+    # The folders nest into each other; handling them shallowest-first lets a
+    # single stat() per folder replace the isfile + exists probes, and a file
+    # "stomped" where an ancestor folder is needed gets cleared before its
+    # descendants are attempted.
+    created = False
+    for folder in sorted(set(needed_folders.values()), key=len):
+        folder_stat = _cached_stat(folder)
+        if folder_stat is not None and not stat.S_ISDIR(folder_stat.st_mode):
+            os.unlink(folder)  # 1. Need a folder. Remove the file
+            folder_stat = None
+        if folder_stat is None:  # 2. Create the needed folder
+            try:
+                os.makedirs(folder)
+            except OSError as err:  # exist_ok, before Python 3 spelled it
+                if err.errno != errno.EEXIST:
+                    raise
+            created = True
+    if created:
+        # The memoized misses above are stale now
+        _cached_stat.cache_clear()
 
     link_parent_modules(script_path, module_name)
 
     result = needed_folders.copy()
     result.update({
-        'checksum_file': get_checksum_path(script_path, module_name),
-        'dependencies_file': get_depends_path(script_path, module_name),
+        'checksum_file': paths.checksum_file,
+        'dependencies_file': paths.dependencies_file,
+        'ast_file': paths.ast_file,
+        'subtree_file': paths.subtree_file,
     })
     return result
 
 
+@_memoize
+def _relative_link_target(orig, dest_dir):
+    # Pure string work, but os.path.relpath walks both paths part by part
+    # and the same (orig, dest_dir) pairs repeat across sibling modules.
+    return os.path.relpath(orig, dest_dir)
+
+
 def _maybe_link_paths(orig, dest):
-    relpath = os.path.relpath(orig, os.path.dirname(dest))
-    if os.path.exists(dest) and not os.path.islink(dest):
+    try:  # One lstat probe; unlike exists() it also sees dangling symlinks
+        dest_stat = os.lstat(dest)
+    except OSError:
+        dest_stat = None
+
+    if dest_stat is not None:
+        try:
+            if os.path.samefile(orig, dest):
+                return False  # Hardlink or symlink already in place
+        except OSError:
+            pass  # `orig` not transpiled yet, or `dest` dangling
+        if stat.S_ISLNK(dest_stat.st_mode):
+            return False  # Symlinked ahead of `orig`; resolves once it lands
         os.unlink(dest)
 
-    if not os.path.exists(dest):
+    try:
+        # Hardlink when possible: spares `go build` a readlink() per
+        # parent package. Falls back to a relative symlink across
+        # filesystems or when `orig` is yet to be transpiled.
+        os.link(orig, dest)
+    except OSError:
+        relpath = _relative_link_target(orig, os.path.dirname(dest))
         try:
             os.symlink(relpath, dest)
         except OSError as err:  # Got created on an OS race condition?
             if 'exists' not in str(err):
                 raise
-        else:
-            logger.debug('Linked %s to %s', orig, dest)
-            return True
-    return False
+            return False
+    logger.debug('Linked %s to %s', orig, dest)
+    return True
 
 
 def fixed_keyword(keyword, split='.'):
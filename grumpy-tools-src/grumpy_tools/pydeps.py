@@ -23,12 +23,6 @@ import sys
 from .compiler import imputil
 from .compiler import util
 
-try:
-  xrange          # Python 2
-except NameError:
-  xrange = range  # Python 3
-
-
 def main(script=None, modname=None, package_dir='', with_imports=False):
   gopath = os.environ['GOPATH']
 
@@ -43,18 +37,21 @@ def main(script=None, modname=None, package_dir='', with_imports=False):
         if not imp.script:
           continue  # Let the ImportError raise on run time
 
-        parts = imp.name.split('.')
-        # Iterate over all packages and the leaf module.
-        for i in xrange(len(parts)):
-          name = '.'.join(parts[:i+1])
+        # Iterate over all packages and the leaf module, growing the
+        # dotted prefix one part at a time instead of re-joining a
+        # slice of the parts per level.
+        name = None
+        for part in imp.name.split('.'):
+          name = part if name is None else name + '.' + part
           if name and name not in names:
             names.add(name)
-            if name.startswith('.'):
-              name = name[1:]
-            yield name
+            yield name[1:] if name.startswith('.') else name
 
+  # Materialized here: callers iterate more than once (logging, caching,
+  # the module.go import block) and a generator would silently come back
+  # empty the second time.
   if with_imports:
-    return _deps(), imports
+    return list(_deps()), imports
   else:
-    return _deps()
+    return list(_deps())
 